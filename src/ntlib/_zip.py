@@ -0,0 +1,423 @@
+"""Low-level bits of the zip format that zipfile doesn't let us do.
+
+zipfile compresses every entry through one deflate stream, so there's no
+way to hand it data we have compressed ourselves.  The writer here only
+knows about the few things that ArchiveDumper needs: deflated entries,
+no encryption, no comments and no ZIP64.
+
+Going the other way, seeking backwards in a file opened by zipfile means
+decompressing everything from the start again.  EntryReader remembers
+where it has been so that it can start reading from the middle.
+"""
+
+from bisect import bisect_right
+import io
+import struct
+import zipfile
+import zlib
+
+__all__ = [
+    'ZipStreamWriter', 'EntryReader', 'EntryCursor', 'compress_chunk',
+    'crc32_combine',
+]
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_LOCAL_SIGNATURE = 0x04034b50
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_CENTRAL_SIGNATURE = 0x02014b50
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_END_SIGNATURE = 0x06054b50
+_DATA_DESCRIPTOR = struct.Struct('<IIII')
+_DESCRIPTOR_SIGNATURE = 0x08074b50
+# Offset of the CRC-32 field in a local file header
+_CRC_OFFSET = 14
+
+_VERSION = 20           # 2.0, needed for deflate
+# The upper byte is the host system, 3 for Unix (as in ZipFile), so that
+# the mode bits in _EXTERNAL_ATTR mean something
+_VERSION_MADE_BY = (3 << 8) | _VERSION
+_FLAG_DESCRIPTOR = 0x08
+# 1980-01-01 00:00:00, the same as what ZipInfo uses by default
+_DOS_TIME = 0
+_DOS_DATE = (0 << 9) | (1 << 5) | 1
+# -rw-------, the same as ZipFile.open(name, 'w')
+_EXTERNAL_ATTR = 0o600 << 16
+_LIMIT = 0xFFFFFFFF
+
+
+def _gf2_matrix_times(matrix, vector):
+    total = 0
+    for row in matrix:
+        if not vector:
+            break
+        if vector & 1:
+            total ^= row
+        vector >>= 1
+    return total
+
+
+def _gf2_matrix_square(matrix):
+    return [_gf2_matrix_times(matrix, row) for row in matrix]
+
+
+def crc32_combine(crc1, crc2, length2):
+    """Return the CRC-32 of two pieces of data put together, given the
+    CRC-32 of both ('crc1' and 'crc2') and the length of the second one.
+
+    This is crc32_combine() from zlib, which the zlib module doesn't have.
+    It lets chunks be checksummed wherever they are compressed.
+    """
+    if length2 <= 0:
+        return crc1
+    # The operator for one zero bit, then for two and four zero bits
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+    # Apply length2 zero bytes to crc1 (the first square in the loop gives
+    # the operator for one zero byte)
+    while True:
+        even = _gf2_matrix_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = _gf2_matrix_square(even)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+def compress_chunk(data, level):
+    """Compress the bytes 'data' as a piece of a raw deflate stream and
+    return (compressed data, CRC-32, size of 'data').
+
+    The output ends on a byte boundary, so that compressed chunks can be
+    concatenated in order (see ZipStreamWriter.open()).  Every chunk is
+    compressed on its own, so that it can be done anywhere, even in
+    another process.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = (compressor.compress(data)
+                  + compressor.flush(zlib.Z_SYNC_FLUSH))
+    return compressed, zlib.crc32(data), len(data)
+
+
+# An empty final block, which ends a stream made of compress_chunk()s
+_FINAL_BLOCK = zlib.compressobj(0, zlib.DEFLATED, -15).flush()
+
+
+class ZipStreamWriter:
+    """Write a zip file one entry at a time to a binary file object.
+
+    If 'fp' is seekable, the sizes and the CRC of each entry are patched
+    into its local header after the data is written.  Otherwise they
+    follow the data in a data descriptor.
+
+    Like ZipFile, the central directory is written when the writer is
+    closed, even when leaving a with statement because of an exception,
+    so that whatever was written can still be read.
+    """
+    def __init__(self, fp):
+        self._fp = fp
+        try:
+            self._seekable = fp.seekable()
+        except AttributeError:
+            self._seekable = False
+        self._pos = fp.tell() if self._seekable else 0
+        # (name, flags, crc, compressed size, size, header offset)
+        self._entries = []
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self, name):
+        """Return an object for writing the deflated entry 'name'.  Pass
+        the results of compress_chunk() to its write_chunk() method in
+        order; the entry is done after the object is closed.
+        """
+        return _DeflateEntry(self, name.encode('ascii'))
+
+    def _write(self, data):
+        self._fp.write(data)
+        self._pos += len(data)
+
+    def _start_entry(self, name):
+        flags = 0 if self._seekable else _FLAG_DESCRIPTOR
+        offset = self._pos
+        self._check_limit(offset)
+        self._write(_LOCAL_HEADER.pack(
+            _LOCAL_SIGNATURE, _VERSION, flags, zipfile.ZIP_DEFLATED,
+            _DOS_TIME, _DOS_DATE, 0, 0, 0, len(name), 0))
+        self._write(name)
+        return flags, offset
+
+    def _finish_entry(self, name, flags, offset, crc, compress_size, size):
+        self._check_limit(compress_size)
+        self._check_limit(size)
+        if flags & _FLAG_DESCRIPTOR:
+            self._write(_DATA_DESCRIPTOR.pack(
+                _DESCRIPTOR_SIGNATURE, crc, compress_size, size))
+        else:
+            self._fp.seek(offset + _CRC_OFFSET)
+            self._fp.write(struct.pack('<III', crc, compress_size, size))
+            self._fp.seek(self._pos)
+        self._entries.append(
+            (name, flags, crc, compress_size, size, offset))
+
+    def _check_limit(self, value):
+        if value > _LIMIT:
+            raise zipfile.LargeZipFile('archive would require ZIP64 '
+                                       'extensions')
+
+    def close(self):
+        """Write the central directory.  The file object is not closed."""
+        if self._closed:
+            return
+        self._closed = True
+        start = self._pos
+        self._check_limit(start)
+        for name, flags, crc, compress_size, size, offset in self._entries:
+            self._write(_CENTRAL_HEADER.pack(
+                _CENTRAL_SIGNATURE, _VERSION_MADE_BY, _VERSION, flags,
+                zipfile.ZIP_DEFLATED, _DOS_TIME, _DOS_DATE, crc,
+                compress_size, size, len(name), 0, 0, 0, 0,
+                _EXTERNAL_ATTR, offset))
+            self._write(name)
+        count = len(self._entries)
+        self._write(_END_RECORD.pack(
+            _END_SIGNATURE, 0, 0, count, count, self._pos - start, start,
+            0))
+
+
+class _DeflateEntry:
+    def __init__(self, zip_writer, name):
+        self._zip_writer = zip_writer
+        self._name = name
+        self._crc = 0
+        self._size = 0
+        self._compress_size = 0
+        self._closed = False
+        self._flags, self._offset = zip_writer._start_entry(name)
+
+    def __enter__(self):
+        return self
+
+    # Like the file objects of ZipFile.open(), the entry is finished
+    # either way
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_chunk(self, chunk):
+        """Write 'chunk', a result of compress_chunk()."""
+        compressed, crc, size = chunk
+        self._crc = crc32_combine(self._crc, crc, size)
+        self._size += size
+        self._write(compressed)
+
+    def _write(self, data):
+        self._zip_writer._write(data)
+        self._compress_size += len(data)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._write(_FINAL_BLOCK)
+        self._zip_writer._finish_entry(
+            self._name, self._flags, self._offset, self._crc,
+            self._compress_size, self._size)
+
+
+class EntryReader:
+    """Read the data of the entry 'info' (a ZipInfo) in the binary file
+    object 'fp', starting at any offset.
+
+    Deflated data can only be decompressed from the start, so the first
+    pass over the entry (scan()) saves a copy of the decompressor every
+    'checkpoint_distance' bytes or so.  Later, read_from() starts from the
+    closest copy before the offset instead of from the start.  A copy
+    takes about 40 KiB (mostly the 32 KiB window).
+    """
+    def __init__(self, fp, info, block_size=1 << 16,
+                 checkpoint_distance=1 << 23):
+        if info.flag_bits & 0x01:
+            raise NotImplementedError('encrypted entries are not supported')
+        if info.compress_type not in (zipfile.ZIP_STORED,
+                                      zipfile.ZIP_DEFLATED):
+            raise NotImplementedError(f'compression method '
+                                      f'{info.compress_type} is not '
+                                      f'supported')
+        fp.seek(info.header_offset)
+        header = fp.read(_LOCAL_HEADER.size)
+        if len(header) != _LOCAL_HEADER.size:
+            raise zipfile.BadZipFile('truncated local file header')
+        fields = _LOCAL_HEADER.unpack(header)
+        if fields[0] != _LOCAL_SIGNATURE:
+            raise zipfile.BadZipFile('bad magic number for file header')
+        name_length, extra_length = fields[-2:]
+        self._fp = fp
+        self._info = info
+        self._start = (info.header_offset + _LOCAL_HEADER.size
+                       + name_length + extra_length)
+        self._deflated = info.compress_type == zipfile.ZIP_DEFLATED
+        self._block_size = block_size
+        self._checkpoint_distance = checkpoint_distance
+        # Uncompressed offsets, offsets in the raw data and copies of the
+        # decompressor right before reading the raw data at that offset
+        self._offsets = [0]
+        self._raw_offsets = [0]
+        self._states = [self.__new_decompressor()]
+
+    @property
+    def size(self):
+        """Size of the uncompressed data."""
+        return self._info.file_size
+
+    def __new_decompressor(self):
+        if self._deflated:
+            return zlib.decompressobj(-15)
+        return None
+
+    def __iter_raw(self, raw_offset):
+        # Seek every time since somebody else may use the file too
+        remaining = self._info.compress_size - raw_offset
+        position = self._start + raw_offset
+        while remaining > 0:
+            self._fp.seek(position)
+            data = self._fp.read(min(self._block_size, remaining))
+            if not data:
+                raise zipfile.BadZipFile('truncated entry '
+                                         f'{self._info.filename!r}')
+            position += len(data)
+            remaining -= len(data)
+            yield data
+
+    def scan(self):
+        """Yield the data from the start as blocks of bytes, checking its
+        CRC-32 and saving checkpoints for read_from() on the way.
+        """
+        crc = 0
+        if self._deflated:
+            # Only keep the checkpoints from the last scan
+            del self._offsets[1:], self._raw_offsets[1:], self._states[1:]
+            decompressor = self._states[0].copy()
+            offset = raw_offset = 0
+            last = 0
+            for raw in self.__iter_raw(0):
+                data = decompressor.decompress(raw)
+                raw_offset += len(raw)
+                offset += len(data)
+                crc = zlib.crc32(data, crc)
+                if data:
+                    yield data
+                if offset - last >= self._checkpoint_distance:
+                    self._offsets.append(offset)
+                    self._raw_offsets.append(raw_offset)
+                    self._states.append(decompressor.copy())
+                    last = offset
+            data = decompressor.flush()
+            crc = zlib.crc32(data, crc)
+            if data:
+                yield data
+        else:
+            for data in self.__iter_raw(0):
+                crc = zlib.crc32(data, crc)
+                yield data
+        if crc != self._info.CRC:
+            raise zipfile.BadZipFile('bad CRC-32 for file '
+                                     f'{self._info.filename!r}')
+
+    def read_from(self, offset):
+        """Yield the data from 'offset' onwards as blocks of bytes."""
+        if not self._deflated:
+            yield from self.__iter_raw(offset)
+            return
+        index = bisect_right(self._offsets, offset) - 1
+        position = self._offsets[index]
+        decompressor = self._states[index].copy()
+        for raw in self.__iter_raw(self._raw_offsets[index]):
+            data = decompressor.decompress(raw)
+            position += len(data)
+            if position > offset:
+                # Only the first block ever needs to be cut
+                data = data[max(len(data) - (position - offset), 0):]
+                yield data
+        data = decompressor.flush()
+        position += len(data)
+        if position > offset:
+            yield data[max(len(data) - (position - offset), 0):]
+
+    def cursor(self):
+        """Return an EntryCursor for reading from increasing offsets."""
+        return EntryCursor(self)
+
+
+class EntryCursor:
+    """Open binary file objects on an entry at increasing offsets.
+
+    As long as the offsets don't go backwards, one pass of read_from() is
+    shared by all of them, so skipping ahead doesn't decompress the data
+    from a checkpoint all over again.  Only the latest file object should
+    be read from.
+    """
+    def __init__(self, reader):
+        self._reader = reader
+        self._blocks = None
+        # The latest block from self._blocks and where it starts
+        self._block = b''
+        self._block_start = 0
+
+    def open_from(self, offset):
+        """Return a binary file object that reads from 'offset'."""
+        return io.BufferedReader(_BlockStream(self.__iter_from(offset)))
+
+    def __next_block(self):
+        block = next(self._blocks, None)
+        if block is None:
+            return False
+        self._block_start += len(self._block)
+        self._block = block
+        return True
+
+    def __iter_from(self, offset):
+        # Whatever is read ahead is gone, so start over if needed (which
+        # hardly happens as blocks are much bigger than read-aheads)
+        if self._blocks is None or offset < self._block_start:
+            self._blocks = self._reader.read_from(offset)
+            self._block = b''
+            self._block_start = offset
+        while self._block_start + len(self._block) <= offset:
+            if not self.__next_block():
+                return
+        yield memoryview(self._block)[offset - self._block_start:]
+        while self.__next_block():
+            yield self._block
+
+
+class _BlockStream(io.RawIOBase):
+    # A raw stream that reads from an iterator of bytes-like objects
+    def __init__(self, blocks):
+        self._blocks = blocks
+        self._rest = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._rest:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._rest = memoryview(block)
+        size = min(len(buffer), len(self._rest))
+        buffer[:size] = self._rest[:size]
+        self._rest = self._rest[size:]
+        return size
@@ -1,31 +1,128 @@
 """dealing with archives"""
 __all__ = [
-    'ArchiveLoader', 'ArchiveDumper',
+    'ArchiveLoader', 'ArchiveDumper', 'ArchiveView', 'TaskPool',
 ]
 
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
 import csv
 import datetime
 import io
+import itertools
+import re
+import sys
 import uuid
 import zipfile
 # Import Task, Event
 from . import *
 from .context import HashedContext
+from ._zip import EntryReader, ZipStreamWriter, compress_chunk
+from .tz import format_timestamp, parse_timestamp
 
 _TASK_HEAD = ('Primary Key', 'Name', 'Abbreviation', 'Colour', 'Hidden',
               'Order', 'ParentKey')
 _EVENT_HEAD = ('Primary Key', 'Start Date', 'End Date', 'Comment', 'TaskKey')
 _TASK_FILE = 'tasks.csv'
 _EVENT_FILE = 'events.csv'
+# XXX dialets
+# all quantities MUST be quoted
+_CSV_FORMAT = {'dialect': 'unix', 'quoting': csv.QUOTE_ALL}
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+# What universal newlines take as the end of a line
+_LINE_END = re.compile(rb'\r\n|\r|\n')
+
+
+# When we load a few hundred backups of the same account, the task trees
+# are pretty much the same from one file to another.  Rather than building
+# a fresh copy of every tree for each file, a TaskPool keeps the trees it
+# has seen and hands them out again.
+class TaskPool:
+    """A pool of tasks that can be shared between loads.
+
+    Pass an instance to ArchiveLoader through the 'task_pool' option.
+    A top-level task and all of its subtasks (a "tree") is reused from the
+    pool only if every task in it has the same primary key, name,
+    abbreviation, color and subtasks as before.  Otherwise a new tree is
+    built and added to the pool, and trees that are already in the pool
+    are never modified (copy-on-write).  Names, abbreviations and colors
+    are interned as well.
+
+    Trees are shared as a whole, not task by task, since a task has only
+    one parent: changing a single subtask of a tree with N tasks adds N
+    new tasks to the pool.  The memory used grows with the number of
+    distinct trees times their size, not with the number of distinct
+    tasks.
+
+    Since tasks from the pool are shared between contexts, they should
+    be treated as read-only.  Modifying one of them modifies it for every
+    context loaded with the same pool.
+    """
+    __slots__ = ('_colors', '_values', '_trees')
+
+    def __init__(self):
+        # Colour column -> color tuple, and color tuple -> itself, so
+        # that '1,0,0,1' and '1.0,0.0,0.0,1.0' give the same tuple
+        self._colors = {}
+        self._values = {}
+        # Signature of a tree -> (top-level task, {key: task})
+        self._trees = {}
+
+    def __len__(self):
+        """Number of distinct trees in the pool."""
+        return len(self._trees)
+
+    def clear(self):
+        self._colors.clear()
+        self._values.clear()
+        self._trees.clear()
+
+    def intern_string(self, string):
+        return sys.intern(string)
+
+    def intern_color(self, color):
+        """Return the color tuple for the Colour column 'color', or None
+        if it is 'Automatic'.
+        """
+        try:
+            return self._colors[color]
+        except KeyError:
+            pass
+        if color == 'Automatic':
+            value = None
+        else:
+            # Let Task do the validation for us
+            value = Task('', color=color.split(',')).color
+            value = self._values.setdefault(value, value)
+        self._colors[color] = value
+        return value
+
+    def get_tree(self, signature):
+        """Return (task, task_map) of the tree with 'signature', or None
+        if no such tree is in the pool.
+        """
+        return self._trees.get(signature)
+
+    def add_tree(self, signature, task, task_map):
+        self._trees[signature] = (task, task_map)
+
+
+# Shared by ArchiveLoader and ArchiveView, so that both see the same
+# text.  Universal newlines turn b'\r\n' and b'\r' into '\n', even inside
+# quoted fields.
+def _open_text(fp):
+    return io.TextIOWrapper(fp, encoding='utf-8')
 
 
 class ArchiveLoader:
     def __init__(self, **kwargs):
         self._all_options = {
-            'time_zone',
+            'time_zone', 'task_pool',
         }
         self.time_zone = datetime.timezone.utc
+        # None means that every load builds its own tasks
+        self.task_pool = None
         self.configure(**kwargs)
 
     def configure(self, **kwargs):
@@ -59,66 +156,323 @@ class ArchiveLoader:
                 yield task_reader, event_reader
 
     def __open_file(self, zf, file):
-        return io.TextIOWrapper(zf.open(file, 'r'),
-                                encoding='utf-8')
+        return _open_text(zf.open(file, 'r'))
 
     def __parse_tasks(self, reader):
         # Columns of tasks.csv (for reference):
         # Primary Key,Name,Abbreviation,Colour,Hidden,Order,ParentKey
         assert tuple(next(reader)) == _TASK_HEAD
 
-        task_map = {}
+        # With no pool given we use a throwaway one, which (almost) boils
+        # down to creating new tasks every time.
+        pool = self.task_pool
+        if pool is None:
+            pool = TaskPool()
+
+        rows = {}
+        children = {}
         for key, name, abbr, color, _, _, parent_key in reader:
-            assert key not in task_map
-            colors = None if color == 'Automatic' else color.split(',')
-            task_map[key] = (Task(name, abbr, colors), parent_key)
-
-        # Now we connect tasks to their appropriate parent tasks
-        for task, parent_key in task_map.values():
-            if parent_key:
-                try:
-                    task_map[parent_key][0].add_subtask(task)
-                except KeyError:
-                    raise ValueError(f'Cannot find parent task '
-                                     f'{parent_id!r} for {name} '
-                                     f'({primary_id})') from None
-
-        return HashedContext({key: task for key, (task, _) in
-                              task_map.items()})
+            assert key not in rows
+            rows[key] = (pool.intern_string(name),
+                         pool.intern_string(abbr),
+                         pool.intern_color(color),
+                         parent_key)
+            children.setdefault(parent_key, []).append(key)
+
+        for key, (name, _, _, parent_key) in rows.items():
+            if parent_key and parent_key not in rows:
+                raise ValueError(f'Cannot find parent task '
+                                 f'{parent_key!r} for {name} ({key})')
+
+        # Now we connect tasks to their appropriate parent tasks, one tree
+        # at a time.  Trees are looked up in the pool as a whole because
+        # a task can only have one parent: if any task in a tree differs,
+        # none of the tasks in it can be shared.
+        task_map = {}
+        for key in children.get('', ()):
+            signature = self.__get_signature(key, rows, children)
+            found = pool.get_tree(signature)
+            if found is None:
+                tree_map = {}
+                task = self.__build_tree(key, None, rows, children,
+                                         tree_map)
+                pool.add_tree(signature, task, tree_map)
+            else:
+                _, tree_map = found
+            task_map.update(tree_map)
+
+        if len(task_map) != len(rows):
+            # Whatever is left is not reachable from a top-level task
+            key = next(key for key in rows if key not in task_map)
+            raise ValueError(f'Circular parent tasks found for '
+                             f'{rows[key][0]} ({key})')
+
+        # Keep the order in tasks.csv
+        return HashedContext({key: task_map[key] for key in rows})
+
+    # Uses recursion
+    def __get_signature(self, key, rows, children):
+        name, abbr, color, _ = rows[key]
+        return (key, name, abbr, color,
+                tuple(self.__get_signature(sub_key, rows, children)
+                      for sub_key in children.get(key, ())))
+
+    # Uses recursion
+    def __build_tree(self, key, parent, rows, children, tree_map):
+        name, abbr, color, _ = rows[key]
+        task = Task(name, abbr, color, parent)
+        tree_map[key] = task
+        for sub_key in children.get(key, ()):
+            self.__build_tree(sub_key, task, rows, children, tree_map)
+        return task
 
     def __parse_events(self, reader, ctx):
         # Columns of events.csv (for reference):
         # Primary Key,Start Date,End Date,Comment,TaskKey
         assert tuple(next(reader)) == _EVENT_HEAD
+        return self._parse_event_rows(reader, ctx)
 
+    # Also used by ArchiveView
+    def _parse_event_rows(self, rows, ctx):
+        time_zone = self.time_zone
         events = []
-        for key, start_str, end_str, comment, task_key in reader:
+        for key, start_str, end_str, comment, task_key in rows:
             task = ctx.get_task_by_key(task_key)
-            # TODO: Somehow parse start time and end time (with the
-            # appropriate time zone!)
-            start = self.__parse_time(start_str)
-            end = self.__parse_time(end_str)
+            start = _from_timestamp(parse_timestamp(start_str), time_zone)
+            end = _from_timestamp(parse_timestamp(end_str), time_zone)
             events.append(Event(task, start, end, comment))
-
         return events
 
-    def __parse_time(self, string):
-        assert string.endswith('Z')
-        # parsed = datetime.datetime.fromisoformat(string[:-1] + '+00:00')
-        fmt = '%Y-%m-%dT%H:%M:%S'
-        parsed = (datetime.datetime.strptime(string[:-1], fmt)
-                  .replace(tzinfo=datetime.timezone.utc))
-        return parsed.astimezone(self.time_zone)
 
+def _from_timestamp(timestamp, time_zone):
+    # No TimeZoneConverter here: fromtimestamp() is exact and quicker than
+    # anything we can do in Python (see TimeZoneConverter.convert())
+    if time_zone is None:
+        # Like astimezone(None), this gives the system's local time zone
+        # (as a fixed offset)
+        return datetime.datetime.fromtimestamp(
+            timestamp, datetime.timezone.utc).astimezone()
+    return datetime.datetime.fromtimestamp(timestamp, time_zone)
+
+
+# Sometimes all we want is a quick look at a backup (how many events are
+# there?  When is the last one?) and parsing everything is overkill.
+class ArchiveView:
+    """A read-only view of the events in an archive, which are decoded
+    only when asked for.
+
+    'file' can be a path or a seekable binary file object.  Events are
+    parsed with 'loader' (a new ArchiveLoader by default), and their tasks
+    come from the context of loader.load_context().
+
+    The first call to len() (or anything that needs it) scans events.csv
+    once.  Only the offset of every 'stride'-th row is kept, along with
+    the checkpoints of EntryReader (see ntlib._zip), so memory grows with
+    the size of the file divided by 'stride' and 'checkpoint_distance'
+    rather than with every row.  After that, an index or a slice only
+    decodes the rows it needs.
+    """
+    def __init__(self, file, loader=None, stride=1024,
+                 checkpoint_distance=1 << 23):
+        if stride < 1:
+            raise ValueError('stride should be at least 1')
+        if loader is None:
+            loader = ArchiveLoader()
+        self._loader = loader
+        self._stride = stride
+        if hasattr(file, 'read'):
+            self._fp = file
+            self._owns_fp = False
+        else:
+            self._fp = open(file, 'rb')
+            self._owns_fp = True
+        try:
+            with zipfile.ZipFile(self._fp) as zf:
+                info = zf.getinfo(_EVENT_FILE)
+            self._reader = EntryReader(
+                self._fp, info, checkpoint_distance=checkpoint_distance)
+        except BaseException:
+            self.close()
+            raise
+        self._context = None
+        # Filled in by __scan()
+        self._offsets = None
+        self._count = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._owns_fp:
+            self._fp.close()
+
+    @property
+    def context(self):
+        """The context of the archive, loaded when first needed."""
+        if self._context is None:
+            self._context = self._loader.load_context(self._fp)
+        return self._context
+
+    # Rows end at a line ending (see _LINE_END) outside of quotes.  Since
+    # every quote inside a field is doubled, a row ends where the number
+    # of quotes since the start of the file is even.  (UTF-8 never has
+    # b'\r', b'\n' or b'"' inside a multibyte character, so bytes are fine
+    # for this.)
+    def __scan(self):
+        stride = self._stride
+        offsets = array('Q')
+        # Row 0 is the header
+        row = 0
+        row_start = 0
+        in_quotes = False
+        position = 0
+        # Whether the last block ended a row with b'\r', which might be
+        # the first half of b'\r\n'
+        after_cr = False
+        recorded = False
+        for block in self._reader.scan():
+            start = 0
+            if after_cr and block.startswith(b'\n'):
+                # The row actually starts after the b'\n'
+                start = 1
+                row_start += 1
+                if recorded:
+                    offsets[-1] += 1
+            after_cr = False
+            for match in _LINE_END.finditer(block, start):
+                if block.count(b'"', start, match.start()) % 2:
+                    in_quotes = not in_quotes
+                start = match.end()
+                if not in_quotes:
+                    row_start = position + start
+                    # This is where data row number 'row' starts
+                    recorded = row % stride == 0
+                    if recorded:
+                        offsets.append(row_start)
+                    row += 1
+                    after_cr = (start == len(block)
+                                and match.group() == b'\r')
+            if block.count(b'"', start) % 2:
+                in_quotes = not in_quotes
+            position += len(block)
+        # The last row doesn't have to end with a line ending
+        if position > row_start:
+            row += 1
+        count = max(row - 1, 0)
+        # We may have recorded the end of the file as well
+        while offsets and (len(offsets) - 1) * stride >= count:
+            offsets.pop()
+        # Check the header before anything is kept, so that every call
+        # fails on a bad file and not just the first one
+        header = next(self.__iter_rows(self._reader.cursor(), 0), None)
+        if header is None or tuple(header) != _EVENT_HEAD:
+            raise ValueError(f'unexpected header in {_EVENT_FILE}: '
+                             f'{header!r}')
+        self._offsets = offsets
+        self._count = count
+
+    def __ensure_scanned(self):
+        if self._offsets is None:
+            self.__scan()
+
+    # Returns the rows of events.csv (as lists of strs) from 'offset'
+    def __iter_rows(self, cursor, offset):
+        return csv.reader(_open_text(cursor.open_from(offset)))
+
+    # Yields events start, start + step, ... (before stop), parsing a
+    # stride of rows at a time so we don't keep everything around
+    def __iter_range(self, start, stop, step=1):
+        if start >= stop:
+            return
+        stride = self._stride
+        index, skip = divmod(start, stride)
+        rows = self.__iter_rows(self._reader.cursor(), self._offsets[index])
+        rows = itertools.islice(rows, skip, skip + (stop - start), step)
+        while True:
+            batch = list(itertools.islice(rows, stride))
+            if not batch:
+                break
+            yield from self._loader._parse_event_rows(batch, self.context)
+
+    # Yields events at 'indices' (in increasing order), jumping to each
+    # one through the offsets instead of going through every row
+    def __iter_indices(self, indices):
+        stride = self._stride
+        cursor = self._reader.cursor()
+        for index in indices:
+            base, skip = divmod(index, stride)
+            rows = self.__iter_rows(cursor, self._offsets[base])
+            row = next(itertools.islice(rows, skip, None))
+            yield from self._loader._parse_event_rows([row], self.context)
+
+    def __len__(self):
+        self.__ensure_scanned()
+        return self._count
+
+    def __getitem__(self, key):
+        self.__ensure_scanned()
+        if isinstance(key, slice):
+            indices = range(self._count)[key]
+            if not indices:
+                return []
+            if indices.step < 0:
+                return self[indices[-1]:indices[0] + 1:-indices.step][::-1]
+            if indices.step > self._stride:
+                return list(self.__iter_indices(indices))
+            return list(self.__iter_range(indices[0], indices[-1] + 1,
+                                          indices.step))
+        index = range(self._count)[key]
+        return next(self.__iter_range(index, index + 1))
+
+    def __iter__(self):
+        self.__ensure_scanned()
+        return self.__iter_range(0, self._count)
 
 
 class ArchiveDumper:
     """
     "It used to be called Dumpy, but now it's ArchiveDumper official!"
+
+    By default everything is written through zipfile on a single thread,
+    and the CSV files are stored without compression (ZIP_STORED).
+
+    Setting the 'workers' option to a number uses a pool of that many
+    processes instead.  Events are sent to the workers in chunks of
+    'chunk_size' events, and each worker generates the keys, formats the
+    rows and deflates the chunk (at 'compresslevel').  The chunks end up
+    in one deflate stream per file, so the result is still a normal zip,
+    only deflated this time.  Apart from the keys (which are random
+    anyway) the CSV files are the same either way.
     """
+    def __init__(self, **kwargs):
+        self._all_options = {
+            'workers', 'chunk_size', 'compresslevel',
+        }
+        self.workers = None
+        self.chunk_size = 10000
+        self.compresslevel = 6
+        self.configure(**kwargs)
+
+    def configure(self, **kwargs):
+        """Configure options.  This method should be called instead of
+        directly accessing the underlying attributes.
+        """
+        invalid = kwargs.keys() - self._all_options
+        if invalid:
+            invalid_str = ', '.join(sorted(invalid))
+            raise ValueError(f'invalid keys: {invalid_str}')
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
     def dump(self, ctx, events, file):
         if not isinstance(ctx, HashedContext):
             ctx = HashedContext.from_tasks(ctx)
+        if self.workers is not None:
+            self.__dump_parallel(ctx, events, file)
+            return
         with zipfile.ZipFile(file, 'w') as zf:
             with self.__open_file(zf, _TASK_FILE) as fp:
                 writer = self.__prepare_writer(fp)
@@ -127,10 +481,66 @@ class ArchiveDumper:
                 writer = self.__prepare_writer(fp)
                 self.__write_events(writer, ctx, events)
 
+    def __dump_parallel(self, ctx, events, file):
+        if self.workers < 1:
+            raise ValueError('workers should be at least 1')
+        if self.chunk_size < 1:
+            raise ValueError('chunk_size should be at least 1')
+        level = self.compresslevel
+        with self.__open_output(file) as fp, ZipStreamWriter(fp) as zw:
+            # There aren't that many tasks, so we do them right here
+            with zw.open(_TASK_FILE) as entry:
+                buffer = io.StringIO()
+                self.__write_tasks(self.__prepare_writer(buffer), ctx)
+                entry.write_chunk(compress_chunk(
+                    buffer.getvalue().encode('utf-8'), level))
+            with ProcessPoolExecutor(
+                    self.workers, initializer=_init_event_worker,
+                    initargs=(frozenset(ctx.get_keys()),)) as executor, \
+                    zw.open(_EVENT_FILE) as entry:
+                buffer = io.StringIO()
+                self.__prepare_writer(buffer).writerow(_EVENT_HEAD)
+                entry.write_chunk(compress_chunk(
+                    buffer.getvalue().encode('utf-8'), level))
+                # Chunks are written in order as they come back, with at
+                # most two per worker in flight
+                pending = deque()
+                for chunk in self.__iter_event_chunks(ctx, events):
+                    pending.append(executor.submit(
+                        _format_event_chunk, chunk, level))
+                    if len(pending) > 2 * self.workers:
+                        entry.write_chunk(pending.popleft().result())
+                while pending:
+                    entry.write_chunk(pending.popleft().result())
+
+    # Only what the workers can't do for us happens here: looking up the
+    # task keys and turning times into plain numbers (which are also much
+    # faster to pickle than datetimes).
+    def __iter_event_chunks(self, ctx, events):
+        second = datetime.timedelta(seconds=1)
+        chunk = []
+        for event in events:
+            chunk.append((ctx.find_task_key(event.task),
+                          (event.start - _EPOCH) // second,
+                          (event.end - _EPOCH) // second,
+                          event.comment))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @contextmanager
+    def __open_output(self, file):
+        # Paths are opened (and closed) by us, just like zipfile does
+        if hasattr(file, 'write'):
+            yield file
+        else:
+            with open(file, 'wb') as fp:
+                yield fp
+
     def __prepare_writer(self, fp):
-        # XXX dialets
-        # all quantities MUST be quoted
-        return csv.writer(fp, dialect='unix', quoting=csv.QUOTE_ALL)
+        return csv.writer(fp, **_CSV_FORMAT)
 
     def __open_file(self, zf, file):
         return io.TextIOWrapper(zf.open(file, 'w'),
@@ -195,3 +605,30 @@ class ArchiveDumper:
         utctime = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
         s = utctime.isoformat(timespec='seconds')
         return s + 'Z'
+
+
+# The rest runs in the worker processes of ArchiveDumper
+_worker_task_keys = frozenset()
+
+
+def _init_event_worker(task_keys):
+    global _worker_task_keys
+    _worker_task_keys = task_keys
+
+
+def _format_event_chunk(rows, level):
+    # Does what ArchiveDumper.__write_events() does, except that keys are
+    # only checked against the tasks and this chunk.  uuid1() is based on
+    # the time, so different workers are not going to run into each other.
+    fp = io.StringIO()
+    writer = csv.writer(fp, **_CSV_FORMAT)
+    keys_generated = set()
+    for task_key, start, end, comment in rows:
+        while True:
+            key = str(uuid.uuid1()).upper()
+            if key not in keys_generated and key not in _worker_task_keys:
+                break
+        keys_generated.add(key)
+        writer.writerow((key, format_timestamp(start), format_timestamp(end),
+                         comment, task_key))
+    return compress_chunk(fp.getvalue().encode('utf-8'), level)
@@ -87,6 +87,13 @@ class Task:
         if value is None:
             self._color = None
             return
+        # A tuple of four floats is already in normalized form.  Keep the
+        # same object so that colors interned elsewhere (see TaskPool in
+        # ntlib.archive) stay shared.
+        if (type(value) is tuple and len(value) == 4
+                and all(type(ch) is float for ch in value)):
+            self._color = value
+            return
         # Since strings are iterables, prevent such usage by throwing
         # a more meaningful message
         if isinstance(value, str):
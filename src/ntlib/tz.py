@@ -0,0 +1,210 @@
+"""Converting lots of timestamps to local time."""
+
+from bisect import bisect_right
+import datetime
+
+__all__ = [
+    'TimeZoneConverter', 'format_timestamp', 'group_by_day',
+    'parse_timestamp',
+]
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_EPOCH_NAIVE = _EPOCH.replace(tzinfo=None)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_US_PER_SECOND = 1000000
+_US_PER_DAY = 86400 * _US_PER_SECOND
+
+
+def parse_timestamp(string):
+    """Parse a time like '2021-11-20T14:34:00Z' (the format used in the
+    archives) into seconds since the epoch.
+    """
+    if not (len(string) == 20 and string[4] == string[7] == '-'
+            and string[10] == 'T' and string[13] == string[16] == ':'
+            and string[19] == 'Z'):
+        raise ValueError(f'invalid time: {string!r}')
+    dt = datetime.datetime(int(string[0:4]), int(string[5:7]),
+                           int(string[8:10]), int(string[11:13]),
+                           int(string[14:16]), int(string[17:19]))
+    return (dt - _EPOCH_NAIVE) // datetime.timedelta(seconds=1)
+
+
+def format_timestamp(timestamp):
+    """Format seconds since the epoch like parse_timestamp() expects."""
+    dt = _EPOCH_NAIVE + datetime.timedelta(seconds=timestamp)
+    return dt.isoformat(timespec='seconds') + 'Z'
+
+
+# Calling astimezone() on every single event is slow with zoneinfo (and
+# we used to do that all over again whenever we grouped events by day).
+# Since UTC offsets change only a few times a year, we find all of them
+# once and look up the right one with bisect.
+class TimeZoneConverter:
+    """Convert seconds since the epoch to local time in 'time_zone'.
+
+    The UTC offsets of 'time_zone' between 'start' and 'end' (both in
+    seconds since the epoch) are found when the converter is created, by
+    probing the time zone every 'step' seconds and narrowing down every
+    change to the exact second, so creating one takes about
+    (end - start) / step calls to the time zone.  Two changes within one
+    step (which no real time zone does) would be missed.  Timestamps
+    outside of the range still work but ask the time zone every time.
+
+    Local times and dates are the same as those of
+
+        (EPOCH + timedelta(seconds=t)).astimezone(time_zone)
+
+    and so are the aware datetimes from convert(), 'fold' included.
+    """
+    __slots__ = ('time_zone', 'start', 'end', '_transitions', '_offsets')
+
+    def __init__(self, time_zone, start, end, step=6 * 3600):
+        if time_zone is None:
+            raise TypeError('time_zone should be a tzinfo object, not None')
+        if start > end:
+            raise ValueError('start later than end')
+        if step <= 0:
+            raise ValueError('step should be positive')
+        self.time_zone = time_zone
+        self.start = start
+        self.end = end
+        # The offset in _offsets[i] (in microseconds) is in effect from
+        # _transitions[i] (inclusive) until the next transition.
+        self._transitions = [start]
+        self._offsets = [self.__get_offset(start)]
+        prev = start
+        prev_offset = self._offsets[0]
+        while prev < end:
+            this = min(prev + step, end)
+            offset = self.__get_offset(this)
+            if offset != prev_offset:
+                self._transitions.append(
+                    self.__find_transition(prev, this, prev_offset))
+                self._offsets.append(offset)
+                prev_offset = offset
+            prev = this
+
+    @classmethod
+    def from_timestamps(cls, time_zone, timestamps, step=6 * 3600):
+        """Create a converter that covers all of 'timestamps' (any
+        iterable).
+
+        If they are spread out so thinly that probing the whole range
+        would take more calls than converting each of them, the converter
+        covers only the first one and the rest ask the time zone.
+        """
+        timestamps = list(timestamps)
+        if not timestamps:
+            return cls(time_zone, 0, 0, step)
+        start = min(timestamps)
+        end = max(timestamps)
+        if (end - start) // step > len(timestamps):
+            end = start
+        return cls(time_zone, start, end, step)
+
+    def __to_local_slow(self, timestamp):
+        return (_EPOCH + datetime.timedelta(seconds=timestamp)).astimezone(
+            self.time_zone)
+
+    def __get_offset(self, timestamp):
+        offset = self.__to_local_slow(timestamp).utcoffset()
+        return offset // datetime.timedelta(microseconds=1)
+
+    # The offset at 'low' is 'low_offset' and the offset at 'high' is
+    # something else.  Returns the first second with the new offset.
+    def __find_transition(self, low, high, low_offset):
+        while high - low > 1:
+            mid = (low + high) // 2
+            if self.__get_offset(mid) == low_offset:
+                low = mid
+            else:
+                high = mid
+        return high
+
+    def utcoffset(self, timestamp):
+        """Return the UTC offset (in microseconds) at 'timestamp'."""
+        if self.start <= timestamp <= self.end:
+            index = bisect_right(self._transitions, timestamp) - 1
+            return self._offsets[index]
+        return self.__get_offset(timestamp)
+
+    # Timestamps in a column are usually (almost) sorted, so we check the
+    # interval of the previous one before resorting to bisect.  Yields
+    # each timestamp with its offset in microseconds.
+    def __iter_offsets(self, timestamps):
+        transitions = self._transitions
+        offsets = self._offsets
+        last = len(transitions) - 1
+        low = high = offset = None
+        for timestamp in timestamps:
+            if low is None or not low <= timestamp < high:
+                if not self.start <= timestamp <= self.end:
+                    yield timestamp, self.__get_offset(timestamp)
+                    continue
+                index = bisect_right(transitions, timestamp) - 1
+                low = transitions[index]
+                high = (transitions[index + 1] if index < last
+                        else self.end + 1)
+                offset = offsets[index]
+            yield timestamp, offset
+
+    def to_local(self, timestamp):
+        """Return the aware datetime for 'timestamp' in the time zone."""
+        return datetime.datetime.fromtimestamp(timestamp, self.time_zone)
+
+    def convert(self, timestamps):
+        """Return a list of aware datetimes for 'timestamps'."""
+        # Putting together datetimes from the offsets in Python turns out
+        # to be slower than what the time zone does in C (at least with
+        # zoneinfo), so we leave this one to the time zone.
+        fromtimestamp = datetime.datetime.fromtimestamp
+        time_zone = self.time_zone
+        return [fromtimestamp(timestamp, time_zone)
+                for timestamp in timestamps]
+
+    def local_timestamp(self, timestamp):
+        """Return the local time of 'timestamp' as seconds since the
+        (local) epoch.  Seconds repeated by a fold are repeated here too.
+        """
+        return timestamp + self.utcoffset(timestamp) // _US_PER_SECOND
+
+    def local_timestamps(self, timestamps):
+        """Return a list of local timestamps (see local_timestamp()) for
+        'timestamps'.
+        """
+        return [timestamp + offset // _US_PER_SECOND
+                for timestamp, offset in self.__iter_offsets(timestamps)]
+
+    def day_ordinal(self, timestamp):
+        """Return the proleptic Gregorian ordinal of the local date of
+        'timestamp' (see date.toordinal()).
+        """
+        return ((timestamp * _US_PER_SECOND + self.utcoffset(timestamp))
+                // _US_PER_DAY + _EPOCH_ORDINAL)
+
+    def day_ordinals(self, timestamps):
+        """Return a list of day ordinals (see day_ordinal()) for
+        'timestamps'.
+        """
+        return [(timestamp * _US_PER_SECOND + offset) // _US_PER_DAY
+                + _EPOCH_ORDINAL
+                for timestamp, offset in self.__iter_offsets(timestamps)]
+
+
+def group_by_day(events, time_zone):
+    """Group 'events' by the local date of their start times in
+    'time_zone'.  Returns a dict that maps datetime.date objects to lists
+    of events, in the order of 'events'.
+
+    The dates are looked up with a TimeZoneConverter, so the events don't
+    have to be converted to 'time_zone' first.
+    """
+    events = list(events)
+    second = datetime.timedelta(seconds=1)
+    timestamps = [(event.start - _EPOCH) // second for event in events]
+    converter = TimeZoneConverter.from_timestamps(time_zone, timestamps)
+    groups = {}
+    for event, ordinal in zip(events, converter.day_ordinals(timestamps)):
+        groups.setdefault(ordinal, []).append(event)
+    return {datetime.date.fromordinal(ordinal): day_events
+            for ordinal, day_events in groups.items()}
@@ -0,0 +1,123 @@
+import csv
+import datetime
+import io
+import unittest
+import zipfile
+from ntlib import Task, Event
+from ntlib.archive import ArchiveDumper, ArchiveLoader
+
+
+class NonSeekable(io.RawIOBase):
+    """A write-only stream that cannot seek (like a pipe)."""
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+class TestDump(unittest.TestCase):
+    def setUp(self):
+        fruit = Task('Fruit', 'F', (1, 0.5, 0, 1))
+        apple = Task('Apple', parent=fruit)
+        sleep = Task('Sleep')
+        self.tasks = [fruit, apple, sleep]
+        start = datetime.datetime(2021, 11, 20, tzinfo=datetime.timezone.utc)
+        self.events = []
+        for i in range(3000):
+            task = self.tasks[i % 3]
+            s = start + datetime.timedelta(minutes=10 * i)
+            e = s + datetime.timedelta(minutes=5)
+            comment = f'event #{i}, with "quotes"\nand a newline' * (i % 4)
+            self.events.append(Event(task, s, e, comment))
+
+    def dump_and_load(self, dumper, file=None):
+        if file is None:
+            file = io.BytesIO()
+        dumper.dump(self.tasks, self.events, file)
+        data = file.getvalue()
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+        return ArchiveLoader().load(io.BytesIO(data))
+
+    def check_loaded(self, ctx, events):
+        self.assertEqual(sorted(t.get_complete_name() for t in ctx),
+                         sorted(t.get_complete_name() for t in self.tasks))
+        self.assertEqual(len(events), len(self.events))
+        for loaded, event in zip(events, self.events):
+            self.assertEqual(loaded.task.get_complete_name(),
+                             event.task.get_complete_name())
+            self.assertEqual(loaded.start, event.start)
+            self.assertEqual(loaded.end, event.end)
+            self.assertEqual(loaded.comment, event.comment)
+
+    def test_serial(self):
+        self.check_loaded(*self.dump_and_load(ArchiveDumper()))
+
+    def test_parallel(self):
+        # Small chunks so that we actually get lots of them
+        dumper = ArchiveDumper(workers=4, chunk_size=100)
+        self.check_loaded(*self.dump_and_load(dumper))
+
+    def test_parallel_single_chunk(self):
+        dumper = ArchiveDumper(workers=2)
+        self.check_loaded(*self.dump_and_load(dumper))
+
+    def test_parallel_non_seekable(self):
+        dumper = ArchiveDumper(workers=3, chunk_size=250)
+        file = NonSeekable()
+        dumper.dump(self.tasks, self.events, file)
+        data = file.buffer.getvalue()
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+        self.check_loaded(*ArchiveLoader().load(io.BytesIO(data)))
+
+    def test_same_csv(self):
+        serial = io.BytesIO()
+        ArchiveDumper().dump(self.tasks, self.events, serial)
+        parallel = io.BytesIO()
+        ArchiveDumper(workers=2, chunk_size=100).dump(
+            self.tasks, self.events, parallel)
+        with zipfile.ZipFile(serial) as zf1, \
+                zipfile.ZipFile(parallel) as zf2:
+            # Each dump generates its own task keys
+            self.assertEqual(zf1.read('tasks.csv').count(b'\n'),
+                             zf2.read('tasks.csv').count(b'\n'))
+            rows1 = list(csv.reader(io.StringIO(
+                zf1.read('events.csv').decode('utf-8'), newline='')))
+            rows2 = list(csv.reader(io.StringIO(
+                zf2.read('events.csv').decode('utf-8'), newline='')))
+            self.assertEqual(zf1.getinfo('events.csv').compress_type,
+                             zipfile.ZIP_STORED)
+            info = zf2.getinfo('events.csv')
+            self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(info.create_system, 3)
+            self.assertEqual(info.external_attr >> 16, 0o600)
+        self.assertEqual(len(rows1), len(rows2))
+        self.assertEqual(rows1[0], rows2[0])
+        # Everything but the keys
+        self.assertEqual([row[1:4] for row in rows1],
+                         [row[1:4] for row in rows2])
+        self.assertEqual(len({row[0] for row in rows2}), len(rows2))
+
+    def test_parallel_error(self):
+        def events():
+            yield from self.events[:500]
+            raise RuntimeError('oops')
+        file = io.BytesIO()
+        with self.assertRaises(RuntimeError):
+            ArchiveDumper(workers=2, chunk_size=100).dump(
+                self.tasks, events(), file)
+        # What was written is still a readable zip
+        with zipfile.ZipFile(io.BytesIO(file.getvalue())) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), ['tasks.csv', 'events.csv'])
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            ArchiveDumper(threads=4)
+        with self.assertRaises(ValueError):
+            ArchiveDumper(workers=0).dump(self.tasks, [], io.BytesIO())
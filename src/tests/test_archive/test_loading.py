@@ -1,6 +1,168 @@
+import csv
+import datetime
+import io
 import unittest
+import zipfile
+import zoneinfo
+from ntlib.archive import ArchiveLoader, TaskPool
+
+TASK_HEAD = ('Primary Key', 'Name', 'Abbreviation', 'Colour', 'Hidden',
+             'Order', 'ParentKey')
+EVENT_HEAD = ('Primary Key', 'Start Date', 'End Date', 'Comment',
+              'TaskKey')
+
+
+def make_archive(task_rows, event_rows=()):
+    """Return a file object of an archive with the given rows."""
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, head, rows in (('tasks.csv', TASK_HEAD, task_rows),
+                                 ('events.csv', EVENT_HEAD, event_rows)):
+            fp = io.StringIO(newline='')
+            writer = csv.writer(fp, dialect='unix', quoting=csv.QUOTE_ALL)
+            writer.writerow(head)
+            writer.writerows(rows)
+            zf.writestr(name, fp.getvalue())
+    file.seek(0)
+    return file
+
+
+FRUIT = ('K1', 'Fruit', 'F', '1.0,0.5,0.0,1.0', '0', '1.00', '')
+APPLE = ('K2', 'Apple', '', 'Automatic', '0', '1.00', 'K1')
+BANANA = ('K3', 'Banana', '', '1.0,1.0,0.0,1.0', '0', '2.00', 'K1')
+SLEEP = ('K4', 'Sleep', 'Zz', '0.0,0.0,1.0,1.0', '0', '2.00', '')
 
 
 class TestLoad(unittest.TestCase):
-    def test_stuff(self):
-        pass
+    def test_tasks(self):
+        ctx = ArchiveLoader().load_context(
+            make_archive([FRUIT, APPLE, BANANA, SLEEP]))
+        self.assertEqual(list(ctx.get_keys()), ['K1', 'K2', 'K3', 'K4'])
+        fruit = ctx.get_task_by_key('K1')
+        self.assertEqual(fruit.name, 'Fruit')
+        self.assertEqual(fruit.color, (1.0, 0.5, 0.0, 1.0))
+        self.assertIsNone(fruit.parent)
+        self.assertIs(ctx.get_task_by_key('K2').parent, fruit)
+        self.assertIs(ctx.get_task_by_key('K3').parent, fruit)
+        self.assertIsNone(ctx.get_task_by_key('K2').color)
+
+    def test_events(self):
+        tz = zoneinfo.ZoneInfo('America/New_York')
+        utc = datetime.timezone.utc
+        # The second one is during the fold
+        events = [('E1', '2021-11-07T04:30:00Z', '2021-11-07T05:10:00Z',
+                   'first', 'K4'),
+                  ('E2', '2021-11-07T06:10:00Z', '2021-11-07T07:00:00Z',
+                   'second', 'K1')]
+        ctx, loaded = ArchiveLoader(time_zone=tz).load(
+            make_archive([FRUIT, SLEEP], events))
+        self.assertEqual(len(loaded), 2)
+        self.assertIs(loaded[0].task, ctx.get_task_by_key('K4'))
+        self.assertIs(loaded[1].task, ctx.get_task_by_key('K1'))
+        self.assertEqual(loaded[1].comment, 'second')
+        for event, (_, start, end, _, _) in zip(loaded, events):
+            for dt, string in ((event.start, start), (event.end, end)):
+                expected = datetime.datetime.strptime(
+                    string, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=utc)
+                expected = expected.astimezone(tz)
+                self.assertIs(dt.tzinfo, tz)
+                self.assertEqual(dt.replace(tzinfo=None),
+                                 expected.replace(tzinfo=None))
+                self.assertEqual(dt.fold, expected.fold)
+        self.assertEqual(loaded[1].start.fold, 1)
+
+    def test_local_time_zone(self):
+        events = [('E1', '2021-11-07T04:30:00Z', '2021-11-07T05:10:00Z',
+                   '', 'K1')]
+        _, loaded = ArchiveLoader(time_zone=None).load(
+            make_archive([FRUIT], events))
+        expected = datetime.datetime(2021, 11, 7, 4, 30,
+                                     tzinfo=datetime.timezone.utc)
+        self.assertEqual(loaded[0].start, expected)
+        self.assertEqual(loaded[0].start.utcoffset(),
+                         expected.astimezone().utcoffset())
+
+    def test_missing_parent(self):
+        orphan = ('K5', 'Orphan', '', 'Automatic', '0', '1.00', 'K9')
+        with self.assertRaises(ValueError):
+            ArchiveLoader().load_context(make_archive([FRUIT, orphan]))
+
+    def test_circular_parents(self):
+        a = ('K5', 'A', '', 'Automatic', '0', '1.00', 'K6')
+        b = ('K6', 'B', '', 'Automatic', '0', '1.00', 'K5')
+        with self.assertRaises(ValueError):
+            ArchiveLoader().load_context(make_archive([FRUIT, a, b]))
+
+
+class TestTaskPool(unittest.TestCase):
+    def test_shared_trees(self):
+        pool = TaskPool()
+        loader = ArchiveLoader(task_pool=pool)
+        rows = [FRUIT, APPLE, BANANA, SLEEP]
+        ctx1 = loader.load_context(make_archive(rows))
+        ctx2 = loader.load_context(make_archive(rows))
+        self.assertEqual(len(pool), 2)
+        for key in ('K1', 'K2', 'K3', 'K4'):
+            self.assertIs(ctx1.get_task_by_key(key),
+                          ctx2.get_task_by_key(key))
+
+    def test_copy_on_write(self):
+        pool = TaskPool()
+        loader = ArchiveLoader(task_pool=pool)
+        ctx1 = loader.load_context(make_archive([FRUIT, APPLE, SLEEP]))
+        renamed = ('K2', 'Green apple') + APPLE[2:]
+        ctx2 = loader.load_context(make_archive([FRUIT, renamed, SLEEP]))
+        self.assertEqual(len(pool), 3)
+        # The Fruit tree changed as a whole...
+        self.assertIsNot(ctx1.get_task_by_key('K1'),
+                         ctx2.get_task_by_key('K1'))
+        self.assertIs(ctx2.get_task_by_key('K2').parent,
+                      ctx2.get_task_by_key('K1'))
+        # ...but the old one is left untouched
+        self.assertEqual(ctx1.get_task_by_key('K2').name, 'Apple')
+        self.assertEqual(
+            [t.name for t in ctx1.get_task_by_key('K1').get_subtasks()],
+            ['Apple'])
+        # Sleep did not change at all
+        self.assertIs(ctx1.get_task_by_key('K4'), ctx2.get_task_by_key('K4'))
+        # Attributes are still interned across different trees
+        self.assertIs(ctx1.get_task_by_key('K1').color,
+                      ctx2.get_task_by_key('K1').color)
+        # No matter how the numbers are written
+        respelled = FRUIT[:3] + ('1,0.5,0,1',) + FRUIT[4:]
+        ctx3 = loader.load_context(make_archive([respelled, SLEEP]))
+        self.assertIs(ctx3.get_task_by_key('K1').color,
+                      ctx1.get_task_by_key('K1').color)
+
+    def test_changed_leaf(self):
+        pool = TaskPool()
+        loader = ArchiveLoader(task_pool=pool)
+        rows = [FRUIT] + [(f'L{i}', f'Leaf {i}', '', 'Automatic', '0',
+                           '1.00', 'K1') for i in range(9)]
+        loader.load_context(make_archive(rows))
+        rows[5] = rows[5][:1] + ('Renamed',) + rows[5][2:]
+        loader.load_context(make_archive(rows))
+        # Trees are only shared as a whole, so all 10 tasks are new
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(
+            sum(len(task_map) for _, task_map in pool._trees.values()),
+            2 * len(rows))
+
+    def test_added_subtask(self):
+        pool = TaskPool()
+        loader = ArchiveLoader(task_pool=pool)
+        ctx1 = loader.load_context(make_archive([FRUIT, APPLE]))
+        ctx2 = loader.load_context(make_archive([FRUIT, APPLE, BANANA]))
+        self.assertIsNot(ctx1.get_task_by_key('K1'),
+                         ctx2.get_task_by_key('K1'))
+        self.assertEqual(
+            len(list(ctx1.get_task_by_key('K1').get_subtasks())), 1)
+        self.assertEqual(
+            len(list(ctx2.get_task_by_key('K1').get_subtasks())), 2)
+
+    def test_no_pool(self):
+        loader = ArchiveLoader()
+        ctx1 = loader.load_context(make_archive([FRUIT]))
+        ctx2 = loader.load_context(make_archive([FRUIT]))
+        self.assertIsNot(ctx1.get_task_by_key('K1'),
+                         ctx2.get_task_by_key('K1'))
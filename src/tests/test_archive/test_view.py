@@ -0,0 +1,214 @@
+import csv
+import datetime
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+import zoneinfo
+from ntlib import Task, Event
+from ntlib.archive import ArchiveDumper, ArchiveLoader, ArchiveView
+from ntlib._zip import EntryReader
+
+
+class TestArchiveView(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fruit = Task('Fruit', 'F', (1, 0.5, 0, 1))
+        apple = Task('Äpfel', parent=fruit)
+        sleep = Task('Sleep')
+        tasks = [fruit, apple, sleep]
+        start = datetime.datetime(2021, 6, 1, tzinfo=datetime.timezone.utc)
+        events = []
+        for i in range(2000):
+            s = start + datetime.timedelta(minutes=7 * i)
+            e = s + datetime.timedelta(minutes=5)
+            # Quotes and newlines inside fields make some rows span
+            # several lines
+            comment = f'#{i} "ünïcode"\n,' * (i % 3)
+            events.append(Event(tasks[i % 3], s, e, comment))
+        cls.tasks = tasks
+        cls.events = events
+        stored = io.BytesIO()
+        ArchiveDumper().dump(tasks, events, stored)
+        deflated = io.BytesIO()
+        ArchiveDumper(workers=2, chunk_size=10000).dump(
+            tasks, events, deflated)
+        cls.archives = {'stored': stored.getvalue(),
+                        'deflated': deflated.getvalue()}
+        cls.time_zone = zoneinfo.ZoneInfo('America/New_York')
+        cls.loader = ArchiveLoader(time_zone=cls.time_zone)
+
+    def views(self, **kwargs):
+        """Return views of every archive (with the same options)."""
+        kwargs.setdefault('loader', self.loader)
+        return [ArchiveView(io.BytesIO(data), **kwargs)
+                for data in self.archives.values()]
+
+    def assert_same_events(self, actual, expected):
+        self.assertEqual(len(actual), len(expected))
+        for a, e in zip(actual, expected):
+            self.assertEqual(a.task.get_complete_name(),
+                             e.task.get_complete_name())
+            self.assertEqual(a.start, e.start)
+            self.assertIs(a.start.tzinfo, self.time_zone)
+            self.assertEqual(a.end, e.end)
+            self.assertEqual(a.comment, e.comment)
+
+    def test_len(self):
+        for view in self.views():
+            self.assertEqual(len(view), len(self.events))
+
+    def test_iter(self):
+        for view in self.views(stride=7, checkpoint_distance=5000):
+            self.assert_same_events(list(view), self.events)
+
+    def test_index(self):
+        indices = [0, 1, 6, 7, 8, 500, 1234, 1999, -1, -2000]
+        for stride in (1, 7, 1024, 5000):
+            for view in self.views(stride=stride, checkpoint_distance=5000):
+                for index in indices:
+                    self.assert_same_events([view[index]],
+                                            [self.events[index]])
+                for index in (2000, -2001):
+                    with self.assertRaises(IndexError):
+                        view[index]
+
+    def test_slice(self):
+        slices = [slice(None), slice(10, 20), slice(5, 100, 7),
+                  slice(-30, None), slice(None, None, -3),
+                  slice(100, 10, -11), slice(1500, 1400), slice(3000, None)]
+        for view in self.views(stride=13, checkpoint_distance=5000):
+            for key in slices:
+                self.assert_same_events(view[key], self.events[key])
+
+    def test_stepped_slice(self):
+        for view in self.views(stride=10, checkpoint_distance=5000):
+            parsed = []
+            parse = view._loader._parse_event_rows
+            view._loader = ArchiveLoader(time_zone=self.time_zone)
+            view._loader._parse_event_rows = (
+                lambda rows, ctx: parsed.extend(rows) or parse(rows, ctx))
+            for key in (slice(None, None, 500), slice(3, None, 11),
+                        slice(None, None, -250)):
+                parsed.clear()
+                events = view[key]
+                self.assert_same_events(events, self.events[key])
+                # Only the events we asked for
+                self.assertEqual(len(parsed), len(events))
+
+    def test_tasks_from_context(self):
+        for view in self.views():
+            task = view[1].task
+            self.assertIn(task, view.context)
+            self.assertIs(view[4].task, task)
+
+    def test_memory(self):
+        for view in self.views(stride=100):
+            len(view)
+            self.assertEqual(len(view._offsets), 20)
+
+    def test_path(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'backup.zip')
+            with open(path, 'wb') as fp:
+                fp.write(self.archives['deflated'])
+            with ArchiveView(path, loader=self.loader) as view:
+                self.assertEqual(len(view), len(self.events))
+                self.assert_same_events([view[-1]], [self.events[-1]])
+            self.assertTrue(view._fp.closed)
+
+    def test_empty(self):
+        data = io.BytesIO()
+        ArchiveDumper().dump(self.tasks, [], data)
+        with ArchiveView(data) as view:
+            self.assertEqual(len(view), 0)
+            self.assertEqual(view[:], [])
+            self.assertEqual(list(view), [])
+
+    def test_bad_crc(self):
+        data = bytearray(self.archives['stored'])
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            info = zf.getinfo('events.csv')
+        # Flip a byte inside the first event
+        data[info.header_offset + 30 + len('events.csv') + 60] ^= 1
+        with ArchiveView(io.BytesIO(data)) as view:
+            with self.assertRaises(zipfile.BadZipFile):
+                len(view)
+
+    def test_bad_header(self):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as zf:
+            zf.writestr('tasks.csv', '')
+            zf.writestr('events.csv', '"x"\n"a"\n')
+        with ArchiveView(data) as view:
+            for _ in range(2):
+                with self.assertRaises(ValueError):
+                    len(view)
+            with self.assertRaises(ValueError):
+                view[0]
+
+    def make_archive(self, lineterminator):
+        """Return an archive like the one the dumper writes, but with
+        'lineterminator' at the end of rows and inside comments.
+        """
+        tasks = io.StringIO(newline='')
+        writer = csv.writer(tasks, lineterminator=lineterminator,
+                            quoting=csv.QUOTE_ALL)
+        writer.writerow(('Primary Key', 'Name', 'Abbreviation', 'Colour',
+                         'Hidden', 'Order', 'ParentKey'))
+        writer.writerow(('t', 'Sleep', 'S', '1,0,0,1', '0', '0', ''))
+        events = io.StringIO(newline='')
+        writer = csv.writer(events, lineterminator=lineterminator,
+                            quoting=csv.QUOTE_ALL)
+        writer.writerow(('Primary Key', 'Start Date', 'End Date', 'Comment',
+                         'TaskKey'))
+        for i in range(300):
+            comment = f'#{i} "x"{lineterminator}y\r\n' * (i % 3)
+            writer.writerow((f'e{i}', f'2021-06-01T00:{i // 60:02}:'
+                             f'{i % 60:02}Z', '2021-06-01T06:00:00Z',
+                             comment, 't'))
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as zf:
+            zf.writestr('tasks.csv', tasks.getvalue())
+            zf.writestr('events.csv', events.getvalue())
+        return data.getvalue()
+
+    def test_line_endings(self):
+        for lineterminator in ('\r\n', '\r', '\n'):
+            data = self.make_archive(lineterminator)
+            _, expected = self.loader.load(io.BytesIO(data))
+            self.assertEqual(len(expected), 300)
+            self.assertNotIn('\r', ''.join(e.comment for e in expected))
+            # Small blocks so that b'\r\n' is split between two of them
+            for block_size in (None, 1, 7, 64):
+                with ArchiveView(io.BytesIO(data), loader=self.loader,
+                                 stride=4) as view:
+                    if block_size is not None:
+                        view._reader._block_size = block_size
+                    self.assertEqual(len(view), len(expected))
+                    self.assert_same_events(list(view), expected)
+                    self.assert_same_events(view[::7], expected[::7])
+                    self.assert_same_events([view[-1], view[5]],
+                                            [expected[-1], expected[5]])
+
+
+class TestEntryReader(unittest.TestCase):
+    def test_read_from(self):
+        data = b''.join(b'%d: %s\n' % (i, b'x' * (i % 50))
+                        for i in range(20000))
+        for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            file = io.BytesIO()
+            with zipfile.ZipFile(file, 'w', compression) as zf:
+                zf.writestr('padding', b'?' * 1000)
+                zf.writestr('data', data)
+                info = zf.getinfo('data')
+            reader = EntryReader(file, info, block_size=256,
+                                 checkpoint_distance=10000)
+            self.assertEqual(b''.join(reader.scan()), data)
+            if compression == zipfile.ZIP_DEFLATED:
+                self.assertGreater(len(reader._states), 10)
+            for offset in (0, 1, 9999, 10000, 10001, 123456, len(data) - 1,
+                           len(data)):
+                self.assertEqual(b''.join(reader.read_from(offset)),
+                                 data[offset:])
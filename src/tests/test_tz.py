@@ -0,0 +1,163 @@
+import datetime
+import unittest
+import zoneinfo
+from ntlib import Task, Event
+from ntlib.tz import (TimeZoneConverter, format_timestamp, group_by_day,
+                      parse_timestamp)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def get_timestamp(timestr):
+    dt = datetime.datetime.fromisoformat(timestr)
+    return (dt - EPOCH) // datetime.timedelta(seconds=1)
+
+
+class TestParseTimestamp(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_timestamp('1970-01-01T00:00:00Z'), 0)
+        self.assertEqual(parse_timestamp('2021-11-20T14:34:05Z'),
+                         get_timestamp('2021-11-20T14:34:05+00:00'))
+        self.assertEqual(parse_timestamp('1969-12-31T23:59:59Z'), -1)
+
+    def test_invalid(self):
+        for string in ('2021-11-20T14:34:05', '2021-11-20 14:34:05Z',
+                       '2021-11-20T14:34Z', '2021-13-20T14:34:05Z'):
+            with self.assertRaises(ValueError):
+                parse_timestamp(string)
+
+
+class TestFormatTimestamp(unittest.TestCase):
+    def test_format(self):
+        for timestamp in (0, -1, 1637418845, 253402300799):
+            string = format_timestamp(timestamp)
+            self.assertEqual(parse_timestamp(string), timestamp)
+        self.assertEqual(format_timestamp(1637418845),
+                         '2021-11-20T14:34:05Z')
+
+
+class TestTimeZoneConverter(unittest.TestCase):
+    def assert_same(self, converter, timestamps):
+        converted = converter.convert(timestamps)
+        ordinals = converter.day_ordinals(timestamps)
+        local_timestamps = converter.local_timestamps(iter(timestamps))
+        for timestamp, dt, ordinal, local in zip(
+                timestamps, converted, ordinals, local_timestamps):
+            expected = (EPOCH + datetime.timedelta(seconds=timestamp)
+                        ).astimezone(converter.time_zone)
+            for actual in (dt, converter.to_local(timestamp)):
+                self.assertEqual(actual.replace(tzinfo=None),
+                                 expected.replace(tzinfo=None))
+                self.assertIs(actual.tzinfo, expected.tzinfo)
+                self.assertEqual(actual.fold, expected.fold, expected)
+                self.assertEqual(actual, expected)
+            self.assertEqual(ordinal, expected.toordinal())
+            self.assertEqual(converter.day_ordinal(timestamp), ordinal)
+            wall = expected.replace(tzinfo=None)
+            expected_local = (wall - EPOCH.replace(tzinfo=None)
+                              ) // datetime.timedelta(seconds=1)
+            self.assertEqual(local, expected_local)
+            self.assertEqual(converter.local_timestamp(timestamp), local)
+            self.assertEqual(converter.utcoffset(timestamp),
+                             expected.utcoffset()
+                             // datetime.timedelta(microseconds=1))
+
+    def around(self, timestr, seconds):
+        middle = get_timestamp(timestr)
+        return list(range(middle - seconds, middle + seconds, 61))
+
+    def test_fixed_offset(self):
+        tz = datetime.timezone(datetime.timedelta(hours=8))
+        start = get_timestamp('2021-01-01T00:00:00+00:00')
+        converter = TimeZoneConverter(tz, start, start + 86400 * 30)
+        self.assert_same(converter, list(range(start, start + 86400 * 30,
+                                               3607)))
+
+    def test_dst(self):
+        tz = zoneinfo.ZoneInfo('America/New_York')
+        start = get_timestamp('2021-01-01T00:00:00+00:00')
+        end = get_timestamp('2022-01-01T00:00:00+00:00')
+        converter = TimeZoneConverter(tz, start, end)
+        # Clocks go forward and back (with a fold)
+        timestamps = (self.around('2021-03-14T02:00:00-05:00', 7200)
+                      + self.around('2021-11-07T01:00:00-05:00', 7200))
+        self.assert_same(converter, timestamps)
+        self.assert_same(converter, list(range(start, end, 86400 - 7)))
+        # Not sorted
+        self.assert_same(converter, timestamps[::-1])
+
+    def test_transitions(self):
+        tz = zoneinfo.ZoneInfo('Europe/London')
+        start = get_timestamp('2021-01-01T00:00:00+00:00')
+        end = get_timestamp('2022-01-01T00:00:00+00:00')
+        converter = TimeZoneConverter(tz, start, end)
+        self.assertEqual(converter._transitions,
+                         [start, get_timestamp('2021-03-28T01:00:00+00:00'),
+                          get_timestamp('2021-10-31T01:00:00+00:00')])
+
+    def test_start_in_fold(self):
+        tz = zoneinfo.ZoneInfo('Europe/London')
+        # 01:30 happens twice on this day; start at the second one
+        start = get_timestamp('2021-10-31T01:30:00+00:00')
+        converter = TimeZoneConverter(tz, start, start + 86400)
+        self.assert_same(converter, list(range(start, start + 7200, 60)))
+
+    def test_out_of_range(self):
+        tz = zoneinfo.ZoneInfo('Australia/Lord_Howe')
+        start = get_timestamp('2021-06-01T00:00:00+00:00')
+        converter = TimeZoneConverter(tz, start, start + 86400)
+        self.assert_same(converter, [start - 86400 * 200, start,
+                                     start + 86400 * 200])
+
+    def test_from_timestamps(self):
+        tz = zoneinfo.ZoneInfo('Europe/Dublin')
+        timestamps = self.around('2021-10-31T01:00:00+00:00', 10000)
+        converter = TimeZoneConverter.from_timestamps(tz, timestamps)
+        self.assertEqual(converter.start, min(timestamps))
+        self.assertEqual(converter.end, max(timestamps))
+        self.assert_same(converter, timestamps)
+        self.assertEqual(TimeZoneConverter.from_timestamps(tz, []).convert([]),
+                         [])
+        converter = TimeZoneConverter.from_timestamps(tz, iter(timestamps))
+        self.assertEqual(converter.end, max(timestamps))
+
+    def test_sparse(self):
+        tz = zoneinfo.ZoneInfo('Europe/Dublin')
+        timestamps = [get_timestamp('1800-01-01T00:00:00+00:00'),
+                      get_timestamp('2021-10-31T01:30:00+00:00'),
+                      get_timestamp('2021-06-01T12:00:00+00:00')]
+        converter = TimeZoneConverter.from_timestamps(tz, timestamps)
+        # Not worth probing two centuries for three timestamps
+        self.assertEqual(len(converter._transitions), 1)
+        self.assert_same(converter, timestamps)
+
+    def test_no_time_zone(self):
+        with self.assertRaises(TypeError):
+            TimeZoneConverter(None, 0, 0)
+
+
+class TestGroupByDay(unittest.TestCase):
+    def test_group(self):
+        tz = zoneinfo.ZoneInfo('America/New_York')
+        task = Task('Sleep')
+        start = get_timestamp('2021-11-05T12:00:00+00:00')
+        events = []
+        for timestamp in range(start, start + 86400 * 4, 3607):
+            dt = EPOCH + datetime.timedelta(seconds=timestamp)
+            events.append(Event(task, dt, dt))
+        groups = group_by_day(events, tz)
+        expected = {}
+        for event in events:
+            date = event.start.astimezone(tz).date()
+            expected.setdefault(date, []).append(event)
+        self.assertEqual(groups, expected)
+        self.assertEqual(group_by_day([], tz), {})
+
+    def test_sparse(self):
+        tz = zoneinfo.ZoneInfo('America/New_York')
+        task = Task('Sleep')
+        old = Event(task, EPOCH.replace(year=1800), EPOCH.replace(year=1800))
+        new = Event(task, EPOCH.replace(year=2021), EPOCH.replace(year=2021))
+        self.assertEqual(group_by_day([old, new], tz),
+                         {datetime.date(1799, 12, 31): [old],
+                          datetime.date(2020, 12, 31): [new]})